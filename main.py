@@ -1,80 +1,218 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from lxml import etree, html as lxml_html
 import re
-from typing import Dict, List
+from typing import Callable, Dict, Final, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
 import html
 import json
+import functools
 
-def fetch_wikipedia_content(url: str) -> str:
-    """Fetch content from Wikipedia page."""
-    response = requests.get(url)
-    return response.text
+_HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+_TEX_ANNOTATIONS = etree.XPath(
+    '//annotation[@encoding="application/x-tex"]/text()', smart_strings=False)
+_TEX_ANNOTATION_RE = re.compile(
+    rb'<annotation[^>]*encoding="application/x-tex"[^>]*>(.*?)</annotation>', re.DOTALL)
 
-def extract_latex_equations(html_content: str) -> List[str]:
+_REFERENCES_MARKER = b'id="References"'
+
+_VARIABLE_PRESENT_RE = re.compile(r'[xy]|\\beta|\\varepsilon', re.IGNORECASE)
+
+_VARIABLES_RE = re.compile(
+    r'(?P<vec>\\mathbf\{(?P<vec_var>[xy])\})'
+    r'|(?P<sub>(?P<sub_var>[xy])_(?P<sub_idx>\{[^}]+\}|[0-9]))'
+    r'|(?P<bare>(?<![\\\w])(?P<bare_var>[xy])(?![\w_]))'
+    r'|(?P<beta>\\beta\b)'
+    r'|(?P<eps>\\varepsilon\b)'
+)
+
+@st.cache_resource
+def _get_session() -> requests.Session:
+    """Shared HTTP session so repeat fetches reuse the pooled TLS connection."""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    session.headers.update({
+        'Accept-Encoding': 'gzip',
+        'User-Agent': 'latex-colorizer/1.0'
+    })
+    return session
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def fetch_wikipedia_content(url: str) -> bytes:
     """
-    Extract LaTeX equations from Wikipedia HTML content.
-    Only extracts equations containing our variables of interest (x, y, β, ε).
+    Fetch content from Wikipedia page.
+    Stops downloading once the References section starts, since the
+    references and navboxes below it rarely carry equations.
+    """
+    content = bytearray()
+    with _get_session().get(url, timeout=10, stream=True) as response:
+        # Raise before caching so error pages (429/5xx) are not kept for a day
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=65536):
+            search_from = max(0, len(content) - len(_REFERENCES_MARKER))
+            content += chunk
+            marker = content.find(_REFERENCES_MARKER, search_from)
+            # Anything after the first References heading is dropped, including
+            # any math placed there. Stopping early also closes the connection
+            # instead of returning it to the session pool.
+            if marker != -1:
+                del content[marker:]
+                break
+    return bytes(content)
+
+def fetch_wikipedia_equations(url: str) -> Optional[List[str]]:
+    """
+    Fetch the LaTeX equations of a Wikipedia article through the MediaWiki API.
+    The parsed article body carries the same TeX annotations as the page but
+    none of the skin, navigation or edit links, and unlike raw wikitext it
+    includes math produced by templates and leaves out commented-out or
+    <nowiki> math. Returns None when the URL is not a /wiki/ article or the
+    API cannot serve it.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    equations = set()
+    parts = urlsplit(url)
+    if not parts.netloc.endswith('wikipedia.org') or not parts.path.startswith('/wiki/'):
+        return None
     
-    math_elements = soup.find_all('math')
+    try:
+        return _fetch_article_equations(parts.netloc, unquote(parts.path[len('/wiki/'):]))
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def _fetch_article_equations(host: str, title: str) -> List[str]:
+    """Cached API fetch; failures raise so they are never cached."""
+    response = _get_session().get(
+        f'https://{host}/w/api.php',
+        params={
+            'action': 'parse',
+            'page': title,
+            'prop': 'text',
+            'disableeditsection': 1,
+            'disabletoc': 1,
+            'redirects': 1,
+            'format': 'json',
+            'formatversion': 2
+        },
+        timeout=10
+    )
+    response.raise_for_status()
+    body = response.json()['parse']['text'].encode('utf-8')
+    # Same cut-off as fetch_wikipedia_content, so both paths agree on a page
+    marker = body.find(_REFERENCES_MARKER)
+    if marker != -1:
+        body = body[:marker]
+    return _filter_equations(_tex_annotations(body))
+
+def _tex_annotations(html_content: bytes) -> List[str]:
+    """
+    Return the text of every TeX annotation on the page.
+    Scans the raw bytes with a regex and only builds an lxml tree when some
+    annotation could not be matched that way.
+    """
+    matches = _TEX_ANNOTATION_RE.findall(html_content)
+    # Counted without quotes, so single-quoted or unquoted encodings that the
+    # regex misses send the page down the lxml path
+    if len(matches) != html_content.count(b'application/x-tex'):
+        tree = lxml_html.document_fromstring(html_content, parser=_HTML_PARSER)
+        return _TEX_ANNOTATIONS(tree)
+    return list(map(html.unescape, map(bytes.decode, matches)))
+
+def _filter_equations(candidates: Iterable[str]) -> List[str]:
+    """
+    Normalize LaTeX sources and keep those containing our variables of
+    interest (x, y, β, ε), without duplicates and in page order.
+    """
+    equations: Dict[str, None] = {}
+    seen = set()
     
-    for math_elem in math_elements:
-        annotation = math_elem.find('annotation', encoding='application/x-tex')
-        if annotation and annotation.string:
-            latex = annotation.string.strip()
-            latex = re.sub(r'\s+', ' ', latex)
+    for candidate in candidates:
+        # Pages repeat the same source often; only normalize it once
+        if candidate in seen:
+            continue
+        seen.add(candidate)
+        
+        latex = candidate.strip()
+        if len(latex) <= 5 or latex.isdigit():
+            continue
+        
+        latex = ' '.join(latex.split())
+        if '\\displaystyle' in latex:
             latex = latex.replace('\\displaystyle', '')
-            
-            if (any(var in latex.lower() for var in ['x', 'y', '\\beta', '\\varepsilon']) 
-                and len(latex) > 5 
-                and not latex.isdigit()):
-                equations.add(latex)
+        
+        if (len(latex) > 5 
+            and not latex.isdigit()
+            and _VARIABLE_PRESENT_RE.search(latex)):
+            equations[latex] = None
     
     return list(equations)
 
+@st.cache_data(show_spinner=False)
+def extract_latex_equations(html_content: bytes) -> List[str]:
+    """
+    Extract LaTeX equations from Wikipedia HTML content.
+    Only extracts equations containing our variables of interest (x, y, β, ε).
+    """
+    return _filter_equations(_tex_annotations(html_content))
+
+def make_colorizer(colors: Dict[str, str]) -> Callable[[str], str]:
+    """
+    Build a colorizer specialised to one color scheme.
+    All replacement strings are rendered once here, so each call on an
+    equation is a single regex substitution with table lookups.
+    """
+    colored = {var: f'\\color{{{colors[var]}}}{{{var}}}' for var in 'xy'}
+    vectors = {var: f'\\mathbf{{{colored[var]}}}' for var in 'xy'}
+    greek = {
+        'beta': f'\\color{{{colors["β"]}}}{{\\beta}}',
+        'eps': f'\\color{{{colors["ε"]}}}{{\\varepsilon}}'
+    }
+    
+    def dispatch(m: re.Match) -> str:
+        kind = m.lastgroup
+        if kind == 'vec':
+            return vectors[m.group('vec_var')]
+        if kind == 'sub':
+            return f"{colored[m.group('sub_var')]}_{m.group('sub_idx')}"
+        if kind == 'bare':
+            return colored[m.group('bare_var')]
+        return greek[kind]
+    
+    def colorize(equation: str) -> str:
+        # One left-to-right pass: inserted \color commands are never rescanned
+        colorized = _VARIABLES_RE.sub(dispatch, equation)
+        
+        if not any(env in colorized for env in ['\\begin{align', '\\begin{equation']):
+            colorized = f'\\begin{{align*}}\n{colorized}\n\\end{{align*}}'
+        
+        return colorized
+    
+    return colorize
+
 def colorize_variables(equation: str, colors: Dict[str, str]) -> str:
     """
     Apply colors to variables in LaTeX equation.
     Handles both regular variables and their vector/matrix forms.
     """
     try:
-        if not any(env in equation for env in ['\\begin{align', '\\begin{equation']):
-            equation = f'\\begin{{align*}}\n{equation}\n\\end{{align*}}'
-        
-        equation = re.sub(r'\\mathbf\{([xy])\}', 
-                         lambda m: fr'\\mathbf{{\color{{{colors[m.group(1)]}}}{{{m.group(1)}}}}}', 
-                         equation)
-        
-        for var in ['x', 'y']:
-            equation = re.sub(fr'{var}_{{([^}}]+)}}', 
-                            fr'\\color{{{colors[var]}}}{{{var}}}_{{\\1}}', 
-                            equation)
-            equation = re.sub(fr'{var}_([0-9])', 
-                            fr'\\color{{{colors[var]}}}{{{var}}}_\\1', 
-                            equation)
-            equation = re.sub(fr'(?<![\\\w]){var}(?![\w_])', 
-                            fr'\\color{{{colors[var]}}}{{{var}}}', 
-                            equation)
-        
-        equation = re.sub(r'\\beta\b', 
-                         fr'\\color{{{colors["β"]}}}{{\\beta}}', 
-                         equation)
-        equation = re.sub(r'\\varepsilon\b', 
-                         fr'\\color{{{colors["ε"]}}}{{\\varepsilon}}', 
-                         equation)
-        
-        return equation
+        return _colorize_cached(equation, tuple(sorted(colors.items())))
     except Exception as e:
         st.error(f"Error processing equation: {str(e)}")
         return equation
 
-def create_interactive_html(equations: List[str], colors: Dict[str, str]) -> str:
-    """Create an interactive HTML page with color controls and equations."""
-    html_content = """
+@functools.lru_cache(maxsize=32)
+def _build_colorizer(colors_key: Tuple[Tuple[str, str], ...]) -> Callable[[str], str]:
+    """One specialised colorizer per color scheme, shared by all equations."""
+    return make_colorizer(dict(colors_key))
+
+@functools.lru_cache(maxsize=512)
+def _colorize_cached(equation: str, colors_key: Tuple[Tuple[str, str], ...]) -> str:
+    """Memoized colorize_variables keyed on the equation and its color scheme."""
+    return _build_colorizer(colors_key)(equation)
+
+# Static parts of the interactive page, built once at import time
+_PAGE_HEAD: Final[str] = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -94,42 +232,8 @@ def create_interactive_html(equations: List[str], colors: Dict[str, str]) -> str
     <body>
         <div class="color-controls">
     """
-    
-    # Add color pickers
-    for var, color in colors.items():
-        html_content += f"""
-            <div class="color-control">
-                <label>{var} variables</label>
-                <input type="color" value="{color}" onchange="updateColor('{var}', this.value)">
-            </div>
-        """
-    
-    html_content += """
-        </div>
-        <div id="equations">
-    """
-    
-    # Add equations
-    for i, eq in enumerate(equations, 1):
-        safe_eq = html.escape(eq)
-        html_content += f"""
-            <div class="equation-container">
-                <h3>Equation {i}</h3>
-                <div id="equation_{i}"></div>
-                <div id="error_{i}" class="error"></div>
-                <details>
-                    <summary>Show original LaTeX</summary>
-                    <pre class="original-latex">{safe_eq}</pre>
-                </details>
-            </div>
-        """
-    
-    # Add JavaScript for color updating and equation rendering
-    html_content += """
-        </div>
-        <script>
-            let colors = """ + json.dumps(colors) + """;
-            let equations = """ + json.dumps(equations) + """;
+
+_PAGE_SCRIPT: Final[str] = """
             
             function updateColor(variable, color) {
                 colors[variable] = color;
@@ -207,7 +311,47 @@ def create_interactive_html(equations: List[str], colors: Dict[str, str]) -> str
     </body>
     </html>
     """
-    return html_content
+
+def create_interactive_html(equations: List[str], colors: Dict[str, str]) -> str:
+    """Create an interactive HTML page with color controls and equations."""
+    parts = [_PAGE_HEAD]
+    
+    # Add color pickers
+    for var, color in colors.items():
+        parts.append(f"""
+            <div class="color-control">
+                <label>{var} variables</label>
+                <input type="color" value="{color}" onchange="updateColor('{var}', this.value)">
+            </div>
+        """)
+    
+    parts.append("""
+        </div>
+        <div id="equations">
+    """)
+    
+    # Add equations
+    for i, eq in enumerate(equations, 1):
+        safe_eq = html.escape(eq)
+        parts.append(f"""
+            <div class="equation-container">
+                <h3>Equation {i}</h3>
+                <div id="equation_{i}"></div>
+                <div id="error_{i}" class="error"></div>
+                <details>
+                    <summary>Show original LaTeX</summary>
+                    <pre class="original-latex">{safe_eq}</pre>
+                </details>
+            </div>
+        """)
+    
+    # Add JavaScript for color updating and equation rendering
+    parts.append("""
+        </div>
+        <script>
+            let colors = """ + json.dumps(colors) + """;
+            let equations = """ + json.dumps(equations) + """;""" + _PAGE_SCRIPT)
+    return ''.join(parts)
 
 
 def create_streamlit_app():
@@ -233,8 +377,10 @@ def create_streamlit_app():
     if process_button:
         try:
             with st.spinner("Fetching and processing equations..."):
-                content = fetch_wikipedia_content(wiki_url)
-                equations = extract_latex_equations(content)
+                equations = fetch_wikipedia_equations(wiki_url)
+                if equations is None:
+                    content = fetch_wikipedia_content(wiki_url)
+                    equations = extract_latex_equations(content)
                 
                 if not equations:
                     st.warning("⚠️ No equations found. Please check the URL.")
@@ -0,0 +1,42 @@
+import warnings
+
+import pytest
+
+from wikipedia_handler import WikipediaLatexHandler
+
+MATH = ('<math><semantics><annotation encoding="application/x-tex">'
+        'x+y</annotation></semantics></math>')
+DIV = ('<div class="interactive-latex" data-equation="LATEX_EQUATION_0" '
+       'data-original="x+y" id="equation-0"></div>')
+
+
+@pytest.mark.parametrize('template', [
+    '﻿<!DOCTYPE html><html><body><p>a{}b</p></body></html>',
+    '<head><title>x</title></head><body><p>{}</p></body>',
+    '<!-- c --><html><body>{}</body></html>',
+    '<!-- c --><!DOCTYPE html><html><body>{}</body></html>',
+    '<?xml version="1.0" encoding="utf-8"?><p>{}</p>',
+    'lead <p>t {} tail</p>',
+])
+def test_extract_and_map_equations_only_rewrites_math(template):
+    """Everything around the replaced <math> element is returned as written."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        rewritten, equations = WikipediaLatexHandler().extract_and_map_equations(
+            template.format(MATH))
+
+    assert equations == ['x+y']
+    assert rewritten.replace('<!DOCTYPE html>\n', '<!DOCTYPE html>') == template.format(DIV)
+
+
+@pytest.mark.parametrize('content', ['', 'plain'])
+def test_extract_and_map_equations_without_math(content):
+    assert WikipediaLatexHandler().extract_and_map_equations(content) == (content, [])
+
+
+def test_extract_and_map_equations_accepts_bytes():
+    content = f'<p>{MATH}</p>'
+    handler = WikipediaLatexHandler()
+    assert (handler.extract_and_map_equations(content.encode('utf-8'))
+            == WikipediaLatexHandler().extract_and_map_equations(content))
+    assert handler.equation_map == {'LATEX_EQUATION_0': 'x+y'}
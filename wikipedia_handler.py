@@ -1,6 +1,6 @@
 from bs4 import BeautifulSoup
 import re
-from typing import List, Tuple
+from typing import List, Tuple, Union
 import streamlit.components.v1 as components
 import html
 
@@ -9,9 +9,14 @@ class WikipediaLatexHandler:
         self.equation_map = {}
         self.style_map = {}
         
-    def extract_and_map_equations(self, html_content: str) -> Tuple[str, List[str]]:
+    def extract_and_map_equations(self, html_content: Union[str, bytes]) -> Tuple[str, List[str]]:
         """Extract LaTeX equations and replace them with placeholders."""
-        soup = BeautifulSoup(html_content, 'html.parser')
+        # html.parser keeps the input as written (fragments, BOM, comments,
+        # declarations), so str(soup) only differs where equations were replaced
+        if isinstance(html_content, bytes):
+            soup = BeautifulSoup(html_content, 'html.parser', from_encoding='utf-8')
+        else:
+            soup = BeautifulSoup(html_content, 'html.parser')
         equations = []
         
         # Find all math elements